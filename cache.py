@@ -0,0 +1,183 @@
+"""
+Cache Helper Functions
+
+Redis cache-aside helpers for expensive read paths (leaderboards).
+Caching is skipped entirely when REDIS_URL is not configured or Redis is unreachable.
+"""
+
+import asyncio
+import os
+from uuid import uuid4
+from typing import Any, Awaitable, Callable, Iterable, List, Optional, Tuple
+
+import orjson
+from dotenv import load_dotenv
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+# Load environment variables from .env file
+load_dotenv()
+
+redis = None
+
+redis_url = os.getenv("REDIS_URL")
+
+if redis_url:
+    redis = Redis.from_url(redis_url)
+
+CACHE_TTL = 60
+LOCK_TTL = 5
+
+# Delete a lock only if it still holds our token (it may have expired and been re-taken)
+RELEASE_LOCK = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+
+# Cached keys embed their namespace's generation ({namespace}:{gen}:{key}); bumping the
+# generation invalidates them all at once, and results computed against an older generation
+# are written under a key no reader will look up again.
+async def get_or_compute(namespace: str, key: str, compute: Callable[[], Awaitable[Any]], ttl: int = CACHE_TTL) -> Any:
+    """Return the cached value for key in namespace, computing and storing it on a miss"""
+    if redis is None:
+        return await compute()
+    try:
+        gen = int(await redis.get(f"{namespace}:gen") or 0)
+        key = f"{namespace}:{gen}:{key}"
+        cached = await redis.get(key)
+        if cached is not None:
+            return orjson.loads(cached)
+        # Only one caller refreshes a missing key; the rest wait briefly for it
+        lock_key = f"lock:{key}"
+        token = uuid4().hex
+        if not await redis.set(lock_key, token, nx=True, ex=LOCK_TTL):
+            for _ in range(LOCK_TTL * 10):
+                await asyncio.sleep(0.1)
+                cached = await redis.get(key)
+                if cached is not None:
+                    return orjson.loads(cached)
+            return await compute()
+        try:
+            value = await compute()
+            await redis.set(key, orjson.dumps(value), ex=ttl)
+            return value
+        finally:
+            await redis.eval(RELEASE_LOCK, 1, lock_key, token)
+    except RedisError:
+        return await compute()
+
+
+async def invalidate(namespace: str) -> None:
+    """Invalidate every key cached under namespace; stale entries expire with their TTL"""
+    if redis is None:
+        return
+    try:
+        await redis.incr(f"{namespace}:gen")
+    except RedisError:
+        pass
+
+
+# Sorted-set leaderboards: lb:{kind}:{stat}:global / :country:{country} / :city:{city} and, for
+# members with both, :country:{country}:city:{city} (same-named cities in different countries)
+# Sets are only trusted while lb:ready exists, i.e. after a complete seed from Mongo; if Redis
+# loses data, later ZINCRBYs rebuild partial sets that readers ignore until the next seed.
+LEADERBOARDS_READY = "lb:ready:v2"  # bump when the key layout changes to force a re-seed
+LEADERBOARDS_SEEDING = "lb:seeding"
+
+LeaderboardEntry = Tuple[str, str, str, float, Optional[str], Optional[str]]
+
+
+def leaderboard_key(kind: str, stat: str, scope: str = "global", country: Optional[str] = None, city: Optional[str] = None) -> str:
+    """Key of the sorted set ranking kind ("teams"/"players") by stat within a scope"""
+    if scope == "city" and city:
+        if country:
+            return f"lb:{kind}:{stat}:country:{country}:city:{city}"
+        return f"lb:{kind}:{stat}:city:{city}"
+    if scope in ("country", "city") and country:
+        return f"lb:{kind}:{stat}:country:{country}"
+    return f"lb:{kind}:{stat}:global"
+
+
+def leaderboard_keys(kind: str, stat: str, country: Optional[str] = None, city: Optional[str] = None) -> List[str]:
+    """Every scoped sorted set a member located in country/city belongs to"""
+    keys = [leaderboard_key(kind, stat)]
+    if country:
+        keys.append(leaderboard_key(kind, stat, "country", country=country))
+    if city:
+        keys.append(leaderboard_key(kind, stat, "city", city=city))
+    if country and city:
+        keys.append(leaderboard_key(kind, stat, "city", country, city))
+    return keys
+
+
+async def incr_leaderboards(entries: Iterable[LeaderboardEntry]) -> None:
+    """Add each (kind, stat, member, amount, country, city) to every scoped leaderboard the
+    member belongs to, in a single round trip"""
+    if redis is None:
+        return
+    try:
+        async with redis.pipeline(transaction=False) as pipe:
+            for kind, stat, member, amount, country, city in entries:
+                for key in leaderboard_keys(kind, stat, country, city):
+                    pipe.zincrby(key, amount, member)
+            await pipe.execute()
+    except RedisError:
+        pass
+
+
+async def top_leaderboard(key: str, limit: int) -> Optional[List[Tuple[str, float]]]:
+    """Highest-scored members of a leaderboard, or None if the sets aren't fully seeded"""
+    if redis is None:
+        return None
+    if limit <= 0:
+        return []
+    try:
+        async with redis.pipeline(transaction=False) as pipe:
+            pipe.exists(LEADERBOARDS_READY)
+            pipe.zrevrange(key, 0, limit - 1, withscores=True)
+            ready, rows = await pipe.execute()
+    except RedisError:
+        return None
+    if not ready:
+        return None
+    return [(member.decode(), score) for member, score in rows]
+
+
+async def seed_leaderboards_once(load: Callable[[], Awaitable[Iterable[LeaderboardEntry]]], timeout: int = 120) -> None:
+    """Seed the sorted sets from load()'s (kind, stat, member, score, country, city) entries.
+
+    Runs once per Redis instance: the first worker seeds into temporary keys, renames them over
+    the live sets and only then marks them ready; concurrent workers wait for it to finish.
+    """
+    if redis is None:
+        return
+    try:
+        if await redis.exists(LEADERBOARDS_READY):
+            return
+        if not await redis.set(LEADERBOARDS_SEEDING, 1, nx=True, ex=timeout):
+            for _ in range(timeout * 10):
+                await asyncio.sleep(0.1)
+                if await redis.exists(LEADERBOARDS_READY) or not await redis.exists(LEADERBOARDS_SEEDING):
+                    return
+            return
+        try:
+            tmp = f"tmp:{uuid4().hex}:"
+            keys = set()
+            async with redis.pipeline(transaction=False) as pipe:
+                for kind, stat, member, score, country, city in await load():
+                    for key in leaderboard_keys(kind, stat, country, city):
+                        pipe.zadd(tmp + key, {member: score})
+                        keys.add(key)
+                await pipe.execute()
+            async with redis.pipeline(transaction=True) as pipe:
+                for key in keys:
+                    pipe.rename(tmp + key, key)
+                pipe.set(LEADERBOARDS_READY, 1)
+                await pipe.execute()
+        finally:
+            await redis.delete(LEADERBOARDS_SEEDING)
+    except RedisError:
+        pass
@@ -5,11 +5,13 @@ MongoDB helper functions ready to use in your backend code.
 Import and use these functions in your API endpoints for database operations.
 """
 
-from pymongo import MongoClient
-from datetime import datetime, timezone
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import DuplicateKeyError
+from datetime import datetime, timedelta, timezone
+import asyncio
 import os
 from dotenv import load_dotenv
-from typing import Union
+from typing import Awaitable, Callable, Union
 from pydantic import BaseModel
 
 # Load environment variables from .env file
@@ -22,11 +24,63 @@ database_url = os.getenv("DATABASE_URL")
 database_name = os.getenv("DATABASE_NAME")
 
 if database_url and database_name:
-    _client = MongoClient(database_url)
+    _client = AsyncIOMotorClient(database_url, maxPoolSize=50, minPoolSize=10, waitQueueTimeoutMS=2000)
     db = _client[database_name]
 
+async def ensure_indexes():
+    """Create the indexes backing the API's lookups and leaderboard pipelines"""
+    if db is None:
+        return
+    await db.team.create_index([("country", 1), ("city", 1), ("name", 1)], unique=True)
+    await db.player.create_index([("team_id", 1), ("country", 1), ("city", 1)])
+    await db.match.create_index("home_team_id")
+    await db.match.create_index("away_team_id")
+    await db.match.create_index("events.type")
+    await db.match.create_index("events.player_id")
+    await db.match.create_index("events.secondary_player_id")
+    await db.formation.create_index("team_id", unique=True)
+    for stat in ("goals", "wins", "points"):
+        await db.team_stats.create_index([(stat, -1)])
+
+async def run_once(name: str, job: Callable[[], Awaitable[None]], timeout: int = 120):
+    """Run job once per database; concurrent workers wait for it to finish before serving.
+
+    A claim older than timeout is treated as abandoned (its worker died mid-job) and taken over.
+    """
+    if db is None:
+        return
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while True:
+        now = datetime.utcnow()
+        try:
+            await db.migrations.insert_one({"_id": name, "state": "running", "started_at": now})
+            break
+        except DuplicateKeyError:
+            pass
+        stale = now - timedelta(seconds=timeout)
+        taken = await db.migrations.find_one_and_update(
+            {"_id": name, "state": "running", "started_at": {"$lt": stale}},
+            {"$set": {"started_at": now}},
+        )
+        if taken is not None:
+            break
+        marker = await db.migrations.find_one({"_id": name})
+        if marker is not None and marker.get("state") == "done":
+            return
+        if loop.time() > deadline:
+            raise TimeoutError(f"Timed out waiting for {name} to finish in another worker")
+        await asyncio.sleep(0.1)
+    try:
+        await job()
+    except BaseException:
+        # release the claim so the next startup retries
+        await db.migrations.delete_one({"_id": name})
+        raise
+    await db.migrations.update_one({"_id": name}, {"$set": {"state": "done"}})
+
 # Helper functions for common database operations
-def create_document(collection_name: str, data: Union[BaseModel, dict]):
+async def create_document(collection_name: str, data: Union[BaseModel, dict]):
     """Insert a single document with timestamp"""
     if db is None:
         raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
@@ -40,10 +94,10 @@ def create_document(collection_name: str, data: Union[BaseModel, dict]):
     data_dict['created_at'] = datetime.now(timezone.utc)
     data_dict['updated_at'] = datetime.now(timezone.utc)
 
-    result = db[collection_name].insert_one(data_dict)
+    result = await db[collection_name].insert_one(data_dict)
     return str(result.inserted_id)
 
-def get_documents(collection_name: str, filter_dict: dict = None, limit: int = None):
+async def get_documents(collection_name: str, filter_dict: dict = None, limit: int = None):
     """Get documents from collection"""
     if db is None:
         raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
@@ -52,4 +106,4 @@ def get_documents(collection_name: str, filter_dict: dict = None, limit: int = N
     if limit:
         cursor = cursor.limit(limit)
     
-    return list(cursor)
+    return await cursor.to_list(length=None)
@@ -1,18 +1,38 @@
+import logging
 import os
+from functools import lru_cache
 from datetime import datetime
-from typing import List, Optional, Literal, Any, Dict
+from typing import List, Optional, Literal, Any, AsyncIterator, Callable, Dict, Iterable, Tuple
 
-from fastapi import FastAPI, HTTPException
+import orjson
+from cachetools import TTLCache
+from fastapi import Body, FastAPI, HTTPException, Query, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from pydantic import BaseModel, Field
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError, PyMongoError
 
-from database import db, create_document, get_documents
+from database import db, ensure_indexes, run_once
+from cache import (
+    redis, get_or_compute, invalidate, leaderboard_key, incr_leaderboards, top_leaderboard,
+    seed_leaderboards_once, LeaderboardEntry,
+)
 from schemas import Team as TeamSchema, Player as PlayerSchema, MatchEvent as MatchEventSchema, Match as MatchSchema, Formation as FormationSchema
 
+logger = logging.getLogger(__name__)
+
 # ----------------------
 # FastAPI app + CORS
 # ----------------------
-app = FastAPI(title="Futsal Leaderboard API")
+# FastAPI runs jsonable_encoder over plain return values before render() (and that rejects
+# ObjectId), so hot handlers return this response directly to skip that walk; orjson then
+# encodes datetime natively and anything else (e.g. ObjectId) falls back to str.
+class BsonORJSONResponse(ORJSONResponse):
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, default=str)
+
+app = FastAPI(title="Futsal Leaderboard API", default_response_class=BsonORJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -22,50 +42,121 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.on_event("startup")
+async def startup():
+    try:
+        await ensure_indexes()
+    except PyMongoError as e:
+        # Keep serving (e.g. so /test can report the problem) when Mongo is down or has duplicates
+        logger.error("Could not create indexes: %s", e)
+    try:
+        # Seed team_stats from the match history exactly once; other workers block here until
+        # it's done so their add_event/end_match increments can't be overwritten by the rebuild
+        await run_once("team_stats", rebuild_team_stats)
+    except (PyMongoError, TimeoutError) as e:
+        logger.error("Could not rebuild team_stats: %s", e)
+    if db is not None:
+        try:
+            await seed_leaderboards_once(load_leaderboard_entries)
+        except PyMongoError as e:
+            logger.error("Could not seed leaderboards: %s", e)
+
 # ----------------------
 # Helpers for Mongo ObjectId and serialization
 # ----------------------
 from bson import ObjectId
 
+# ObjectId is immutable, so parsed ids can be shared; invalid ids raise and are never cached
+@lru_cache(maxsize=4096)
+def _oid(id_str: str) -> ObjectId:
+    return ObjectId(id_str)
+
 def to_object_id(id_str: Optional[str]) -> Optional[ObjectId]:
     if id_str is None:
         return None
     try:
-        return ObjectId(id_str)
+        return _oid(id_str)
     except Exception:
         raise HTTPException(status_code=400, detail=f"Invalid id: {id_str}")
 
 
+# Naive UTC truncated to milliseconds, i.e. exactly what BSON stores, so documents echoed
+# from a write match the same documents read back later
+def utcnow() -> datetime:
+    now = datetime.utcnow()
+    return now.replace(microsecond=now.microsecond // 1000 * 1000)
+
+
+# Documents read back from Mongo are trusted: handlers return plain dicts and declare
+# no response_model, so Pydantic only validates inbound request bodies.
+# Serializers rewrite the document in place: Motor hands out a fresh dict per row.
 def serialize_doc(doc: Dict[str, Any]) -> Dict[str, Any]:
     if not doc:
         return doc
-    d = dict(doc)
-    if d.get("_id"):
-        d["id"] = str(d.pop("_id"))
+    if doc.get("_id"):
+        doc["id"] = str(doc.pop("_id"))
     # convert nested ids in events
-    if "events" in d and isinstance(d["events"], list):
-        for ev in d["events"]:
+    if "events" in doc and isinstance(doc["events"], list):
+        for ev in doc["events"]:
             if isinstance(ev, dict):
-                if ev.get("player_id") and isinstance(ev["player_id"], ObjectId):
-                    ev["player_id"] = str(ev["player_id"])
-                if ev.get("secondary_player_id") and isinstance(ev["secondary_player_id"], ObjectId):
-                    ev["secondary_player_id"] = str(ev["secondary_player_id"])
-                if ev.get("team_id") and isinstance(ev["team_id"], ObjectId):
-                    ev["team_id"] = str(ev["team_id"])
-    for k, v in d.items():
+                _stringify_ids(ev, _EVENT_ID_FIELDS)
+    for k, v in doc.items():
         if isinstance(v, ObjectId):
-            d[k] = str(v)
-    return d
+            doc[k] = str(v)
+    return doc
+
+_EVENT_ID_FIELDS = ("team_id", "player_id", "secondary_player_id")
+_MATCH_ID_FIELDS = ("home_team_id", "away_team_id", "winner_team_id")
+
+def _stringify_ids(doc: Dict[str, Any], fields: Tuple[str, ...]) -> None:
+    for k in fields:
+        v = doc.get(k)
+        if v is not None:
+            doc[k] = str(v)
+
+# Fast paths for known collections: only the fields that hold ObjectIds are touched
+def serialize_team(doc: Dict[str, Any]) -> Dict[str, Any]:
+    doc["id"] = str(doc.pop("_id"))
+    return doc
+
+def serialize_player(doc: Dict[str, Any]) -> Dict[str, Any]:
+    doc["id"] = str(doc.pop("_id"))
+    _stringify_ids(doc, ("team_id",))
+    return doc
+
+def serialize_match(doc: Dict[str, Any]) -> Dict[str, Any]:
+    doc["id"] = str(doc.pop("_id"))
+    _stringify_ids(doc, _MATCH_ID_FIELDS)
+    for ev in doc.get("events") or ():
+        _stringify_ids(ev, _EVENT_ID_FIELDS)
+    return doc
+
+# Encode a cursor as a JSON array one document at a time instead of materializing the list
+async def stream_json_array(cursor, serialize: Callable[[Dict[str, Any]], Dict[str, Any]] = serialize_doc) -> AsyncIterator[bytes]:
+    sep = b"["
+    async for doc in cursor:
+        yield sep + orjson.dumps(serialize(doc), default=str)
+        sep = b","
+    yield b"]" if sep == b"," else b"[]"
 
 # ----------------------
 # Basic endpoints
 # ----------------------
+# Static payloads are encoded once at import time
+_ROOT_BYTES = orjson.dumps({"message": "Futsal Leaderboard API is running"})
+_SCHEMA_BYTES = orjson.dumps({
+    "team": TeamSchema.model_json_schema(),
+    "player": PlayerSchema.model_json_schema(),
+    "match": MatchSchema.model_json_schema(),
+    "formation": FormationSchema.model_json_schema(),
+})
+
 @app.get("/")
-def read_root():
-    return {"message": "Futsal Leaderboard API is running"}
+async def read_root():
+    return Response(_ROOT_BYTES, media_type="application/json")
 
 @app.get("/test")
-def test_database():
+async def test_database():
     response = {
         "backend": "✅ Running",
         "database": "❌ Not Available",
@@ -78,20 +169,15 @@ def test_database():
             response["database"] = "❌ Not Connected"
         else:
             response["database"] = "✅ Connected"
-            response["collections"] = db.list_collection_names()
+            response["collections"] = await db.list_collection_names()
     except Exception as e:
         response["database"] = f"⚠️ Error: {str(e)[:80]}"
     return response
 
 # Expose schemas (lightweight) so viewers can inspect
 @app.get("/schema")
-def get_schema():
-    return {
-        "team": TeamSchema.model_json_schema(),
-        "player": PlayerSchema.model_json_schema(),
-        "match": MatchSchema.model_json_schema(),
-        "formation": FormationSchema.model_json_schema(),
-    }
+async def get_schema():
+    return Response(_SCHEMA_BYTES, media_type="application/json")
 
 # ----------------------
 # Teams
@@ -100,19 +186,24 @@ class TeamCreate(TeamSchema):
     pass
 
 @app.post("/teams")
-def create_team(team: TeamCreate):
+async def create_team(team: TeamCreate):
     if db is None:
         raise HTTPException(status_code=500, detail="Database not configured")
     # unique by name within city + country
-    existing = db.team.find_one({"name": team.name, "country": team.country, "city": team.city})
+    existing = await db.team.find_one({"name": team.name, "country": team.country, "city": team.city})
     if existing:
         raise HTTPException(status_code=400, detail="Team already exists in this city")
-    team_id = create_document("team", team)
-    doc = db.team.find_one({"_id": ObjectId(team_id)})
-    return serialize_doc(doc)
+    now = utcnow()
+    doc = {**team.model_dump(), "created_at": now, "updated_at": now}
+    try:
+        doc["_id"] = (await db.team.insert_one(doc)).inserted_id
+    except DuplicateKeyError:
+        # lost a race with a concurrent create of the same team
+        raise HTTPException(status_code=400, detail="Team already exists in this city")
+    return BsonORJSONResponse(serialize_team(doc))
 
 @app.get("/teams")
-def list_teams(country: Optional[str] = None, city: Optional[str] = None):
+async def list_teams(country: Optional[str] = None, city: Optional[str] = None):
     if db is None:
         raise HTTPException(status_code=500, detail="Database not configured")
     filt = {}
@@ -120,8 +211,8 @@ def list_teams(country: Optional[str] = None, city: Optional[str] = None):
         filt["country"] = country
     if city:
         filt["city"] = city
-    teams = list(db.team.find(filt).sort("name", 1))
-    return [serialize_doc(t) for t in teams]
+    # Streamed: headers (status 200) go out first, so a cursor error mid-way truncates the body
+    return StreamingResponse(stream_json_array(db.team.find(filt).sort("name", 1), serialize_team), media_type="application/json")
 
 # ----------------------
 # Players
@@ -130,25 +221,26 @@ class PlayerCreate(PlayerSchema):
     pass
 
 @app.post("/players")
-def create_player(player: PlayerCreate):
+async def create_player(player: PlayerCreate):
     if db is None:
         raise HTTPException(status_code=500, detail="Database not configured")
     data = player.model_dump()
     if data.get("team_id"):
         data["team_id"] = to_object_id(data["team_id"])
-    pid = db.player.insert_one({**data, "created_at": datetime.utcnow(), "updated_at": datetime.utcnow()}).inserted_id
-    doc = db.player.find_one({"_id": pid})
-    return serialize_doc(doc)
+    now = utcnow()
+    doc = {**data, "created_at": now, "updated_at": now}
+    doc["_id"] = (await db.player.insert_one(doc)).inserted_id
+    return BsonORJSONResponse(serialize_player(doc))
 
 @app.get("/players")
-def list_players(team_id: Optional[str] = None):
+async def list_players(team_id: Optional[str] = None):
     if db is None:
         raise HTTPException(status_code=500, detail="Database not configured")
     filt: Dict[str, Any] = {}
     if team_id:
         filt["team_id"] = to_object_id(team_id)
-    players = list(db.player.find(filt).sort("name", 1))
-    return [serialize_doc(p) for p in players]
+    # Streamed: headers (status 200) go out first, so a cursor error mid-way truncates the body
+    return StreamingResponse(stream_json_array(db.player.find(filt).sort("name", 1), serialize_player), media_type="application/json")
 
 # ----------------------
 # Matches & Events
@@ -158,21 +250,32 @@ class MatchStart(BaseModel):
     away_team_id: str
 
 @app.post("/matches/start")
-def start_match(payload: MatchStart):
+async def start_match(payload: MatchStart):
     if db is None:
         raise HTTPException(status_code=500, detail="Database not configured")
     match = {
         "home_team_id": to_object_id(payload.home_team_id),
         "away_team_id": to_object_id(payload.away_team_id),
-        "started_at": datetime.utcnow(),
+        "started_at": utcnow(),
         "ended_at": None,
         "events": [],
         "home_score": 0,
         "away_score": 0,
         "winner_team_id": None,
     }
-    mid = db.match.insert_one(match).inserted_id
-    return {"match_id": str(mid), **serialize_doc(match | {"_id": mid})}
+    mid = (await db.match.insert_one(match)).inserted_id
+    return BsonORJSONResponse({
+        "match_id": str(mid),
+        "id": str(mid),
+        "home_team_id": str(match["home_team_id"]),
+        "away_team_id": str(match["away_team_id"]),
+        "started_at": match["started_at"],
+        "ended_at": None,
+        "events": [],
+        "home_score": 0,
+        "away_score": 0,
+        "winner_team_id": None,
+    })
 
 class EventCreate(BaseModel):
     type: Literal["goal","assist","yellow","red","own_goal","substitution"]
@@ -182,14 +285,33 @@ class EventCreate(BaseModel):
     minute: Optional[int] = Field(None, ge=0, le=60)
     notes: Optional[str] = None
 
-@app.post("/matches/{match_id}/event")
-def add_event(match_id: str, event: EventCreate):
-    if db is None:
-        raise HTTPException(status_code=500, detail="Database not configured")
-    m = db.match.find_one({"_id": to_object_id(match_id)})
-    if not m:
-        raise HTTPException(status_code=404, detail="Match not found")
+# Per-process L1 cache of team/player metadata, which practically never changes (60s TTL)
+_team_cache: TTLCache = TTLCache(maxsize=10_000, ttl=60)
+_player_cache: TTLCache = TTLCache(maxsize=10_000, ttl=60)
+
+async def _get_cached(collection, cache: TTLCache, ids: Iterable[ObjectId]) -> Dict[ObjectId, Dict[str, Any]]:
+    found: Dict[ObjectId, Dict[str, Any]] = {}
+    missing = []
+    for oid in ids:
+        doc = cache.get(str(oid))
+        if doc is None:
+            missing.append(oid)
+        else:
+            found[oid] = doc
+    if missing:
+        async for doc in collection.find({"_id": {"$in": missing}}):
+            cache[str(doc["_id"])] = doc
+            found[doc["_id"]] = doc
+    return found
+
+async def get_teams_cached(ids: Iterable[ObjectId]) -> Dict[ObjectId, Dict[str, Any]]:
+    return await _get_cached(db.team, _team_cache, ids)
 
+async def get_players_cached(ids: Iterable[ObjectId]) -> Dict[ObjectId, Dict[str, Any]]:
+    return await _get_cached(db.player, _player_cache, ids)
+
+# Stored form of an event: ids as ObjectId plus a server timestamp
+def prepare_event(event: EventCreate) -> Dict[str, Any]:
     ev = event.model_dump()
     if ev.get("team_id"):
         ev["team_id"] = to_object_id(ev["team_id"])
@@ -197,57 +319,212 @@ def add_event(match_id: str, event: EventCreate):
         ev["player_id"] = to_object_id(ev["player_id"])
     if ev.get("secondary_player_id"):
         ev["secondary_player_id"] = to_object_id(ev["secondary_player_id"])
-    ev["timestamp"] = datetime.utcnow()
-
-    # Update score if goal/own_goal
-    home_id = m["home_team_id"]
-    away_id = m["away_team_id"]
-    inc = {"events": ev, "updated_at": datetime.utcnow()}
-
-    if event.type == "goal":
-        if ev.get("team_id") == home_id:
-            db.match.update_one({"_id": m["_id"]}, {"$inc": {"home_score": 1}, "$push": {"events": ev}})
-        elif ev.get("team_id") == away_id:
-            db.match.update_one({"_id": m["_id"]}, {"$inc": {"away_score": 1}, "$push": {"events": ev}})
-        else:
-            db.match.update_one({"_id": m["_id"]}, {"$push": {"events": ev}})
-    elif event.type == "own_goal":
-        if ev.get("team_id") == home_id:
-            db.match.update_one({"_id": m["_id"]}, {"$inc": {"away_score": 1}, "$push": {"events": ev}})
-        elif ev.get("team_id") == away_id:
-            db.match.update_one({"_id": m["_id"]}, {"$inc": {"home_score": 1}, "$push": {"events": ev}})
-        else:
-            db.match.update_one({"_id": m["_id"]}, {"$push": {"events": ev}})
-    else:
-        db.match.update_one({"_id": m["_id"]}, {"$push": {"events": ev}})
+    ev["timestamp"] = utcnow()
+    return ev
+
+# Team credited with a goal/own_goal event, or None when the event doesn't change the score
+def scoring_team(m: Dict[str, Any], ev: Dict[str, Any]) -> Optional[ObjectId]:
+    team_id = ev.get("team_id")
+    if not team_id:
+        return None
+    if ev["type"] == "goal":
+        if team_id == m["home_team_id"]:
+            return m["home_team_id"]
+        if team_id == m["away_team_id"]:
+            return m["away_team_id"]
+    elif ev["type"] == "own_goal":
+        if team_id == m["home_team_id"]:
+            return m["away_team_id"]
+        if team_id == m["away_team_id"]:
+            return m["home_team_id"]
+    return None
+
+# (stat, player_id) pairs an event counts towards on the player leaderboards
+def player_credits(ev: Dict[str, Any]) -> List[Tuple[str, ObjectId]]:
+    credits = []
+    if ev["type"] == "goal":
+        credits = [("goals", ev.get("player_id")), ("assists", ev.get("secondary_player_id"))]
+    elif ev["type"] == "assist":
+        credits = [("assists", ev.get("player_id"))]
+    elif ev["type"] in ("yellow", "red"):
+        credits = [(ev["type"], ev.get("player_id"))]
+    return [(stat, pid) for stat, pid in credits if pid]
+
+# Credit teams (team_id -> {stat: amount}) and players ((stat, player_id) pairs) on the sorted
+# sets with a single Redis round trip per request
+async def bump_leaderboards(team_amounts: Dict[ObjectId, Dict[str, float]], credits: List[Tuple[str, ObjectId]]):
+    if redis is None or not (team_amounts or credits):
+        return
+    teams = await get_teams_cached(team_amounts)
+    players = await get_players_cached({pid for _, pid in credits})
+    entries: List[LeaderboardEntry] = []
+    for tid, amounts in team_amounts.items():
+        team = teams.get(tid)
+        if team:
+            entries += [("teams", stat, str(tid), amount, team.get("country"), team.get("city"))
+                        for stat, amount in amounts.items()]
+    for stat, pid in credits:
+        p = players.get(pid)
+        if p:
+            entries.append(("players", stat, str(pid), 1, p.get("country"), p.get("city")))
+    await incr_leaderboards(entries)
+
+# Winner of a match from its current score, None for a draw
+WINNER_EXPR = {"$switch": {
+    "branches": [
+        {"case": {"$gt": ["$home_score", "$away_score"]}, "then": "$home_team_id"},
+        {"case": {"$gt": ["$away_score", "$home_score"]}, "then": "$away_team_id"},
+    ],
+    "default": None,
+}}
+
+# Append events and move the score in one pipeline update; an ended match's winner follows
+# its new score so events recorded after the final whistle can still change the result
+def events_update(evs: List[Dict[str, Any]], home_goals: Any, away_goals: Any) -> List[Dict[str, Any]]:
+    return [
+        {"$set": {
+            "events": {"$concatArrays": [{"$ifNull": ["$events", []]}, {"$literal": evs}]},
+            "home_score": {"$add": ["$home_score", home_goals]},
+            "away_score": {"$add": ["$away_score", away_goals]},
+            "updated_at": "$$NOW",
+        }},
+        {"$set": {"winner_team_id": {"$cond": [{"$ifNull": ["$ended_at", False]}, WINNER_EXPR, "$winner_team_id"]}}},
+    ]
 
-    m2 = db.match.find_one({"_id": m["_id"]})
-    return serialize_doc(m2)
+# Standings (wins/draws/points) each team earns from a final score
+def match_result(m: Dict[str, Any], home_score: int, away_score: int) -> Dict[ObjectId, Dict[str, int]]:
+    home, away = m["home_team_id"], m["away_team_id"]
+    if home_score == away_score:
+        return {t: {"wins": 0, "draws": 1, "points": 1} for t in (home, away)}
+    winner = home if home_score > away_score else away
+    return {t: {"wins": 1, "draws": 0, "points": 3} if t == winner else {"wins": 0, "draws": 0, "points": 0}
+            for t in (home, away)}
+
+# Change in standings when goals (team_id -> count) land on an already-ended match m (post-image)
+def result_delta(m: Dict[str, Any], goals: Dict[ObjectId, int]) -> Dict[ObjectId, Dict[str, int]]:
+    if m.get("ended_at") is None or not goals:
+        return {}
+    new = match_result(m, m["home_score"], m["away_score"])
+    old = match_result(m, m["home_score"] - goals.get(m["home_team_id"], 0),
+                       m["away_score"] - goals.get(m["away_team_id"], 0))
+    delta: Dict[ObjectId, Dict[str, int]] = {}
+    for t in new:
+        changed = {k: new[t][k] - old[t][k] for k in new[t] if new[t][k] != old[t][k]}
+        if changed:
+            delta[t] = changed
+    return delta
+
+# Credit stored events (goals per team, player credits) to team_stats and the leaderboards
+async def credit_events(m: Dict[str, Any], goals: Dict[ObjectId, int], credits: List[Tuple[str, ObjectId]]):
+    team_incs: Dict[ObjectId, Dict[str, int]] = {t: {"goals": n} for t, n in goals.items()}
+    for t, changed in result_delta(m, goals).items():
+        team_incs.setdefault(t, {}).update(changed)
+    if team_incs:
+        await db.team_stats.bulk_write([
+            UpdateOne({"_id": t}, {"$inc": inc}, upsert=True) for t, inc in team_incs.items()
+        ], ordered=False)
+    await bump_leaderboards({t: {k: v for k, v in inc.items() if k != "draws"} for t, inc in team_incs.items()}, credits)
+    await invalidate("v1:lb")
 
-@app.post("/matches/{match_id}/end")
-def end_match(match_id: str):
+@app.post("/matches/{match_id}/event")
+async def add_event(match_id: str, event: EventCreate):
     if db is None:
         raise HTTPException(status_code=500, detail="Database not configured")
-    m = db.match.find_one({"_id": to_object_id(match_id)})
+    oid = to_object_id(match_id)
+    ev = prepare_event(event)
+
+    # Update score if goal/own_goal, comparing against the match's own team ids server-side
+    team_id = ev.get("team_id")
+    home_goal: Any = False
+    away_goal: Any = False
+    if team_id and event.type == "goal":
+        home_goal = {"$eq": ["$home_team_id", team_id]}
+        away_goal = {"$eq": ["$away_team_id", team_id]}
+    elif team_id and event.type == "own_goal":
+        home_goal = {"$eq": ["$away_team_id", team_id]}
+        away_goal = {"$eq": ["$home_team_id", team_id]}
+
+    update = events_update([ev], {"$cond": [home_goal, 1, 0]}, {"$cond": [away_goal, 1, 0]})
+    m = await db.match.find_one_and_update({"_id": oid}, update, return_document=ReturnDocument.AFTER)
     if not m:
         raise HTTPException(status_code=404, detail="Match not found")
-    winner = None
-    if m["home_score"] > m["away_score"]:
-        winner = m["home_team_id"]
-    elif m["away_score"] > m["home_score"]:
-        winner = m["away_team_id"]
-    db.match.update_one({"_id": m["_id"]}, {"$set": {"ended_at": datetime.utcnow(), "winner_team_id": winner}})
-    m2 = db.match.find_one({"_id": m["_id"]})
-    return serialize_doc(m2)
+
+    scorer = scoring_team(m, ev)
+    await credit_events(m, {scorer: 1} if scorer is not None else {}, player_credits(ev))
+    return BsonORJSONResponse(serialize_match(m))
+
+# Bounds the size of the single match update a bulk request turns into (Mongo caps documents at 16MB)
+MAX_BULK_EVENTS = 500
+
+@app.post("/matches/{match_id}/events:bulk")
+async def add_events_bulk(match_id: str, events: List[EventCreate] = Body(..., max_length=MAX_BULK_EVENTS)):
+    if db is None:
+        raise HTTPException(status_code=500, detail="Database not configured")
+    oid = to_object_id(match_id)
+    evs = [prepare_event(e) for e in events]
+    m = await db.match.find_one({"_id": oid}, {"home_team_id": 1, "away_team_id": 1})
+    if not m:
+        raise HTTPException(status_code=404, detail="Match not found")
+    if not evs:
+        return await get_match(match_id)
+
+    # Score deltas are resolved here from the single read, then all events are applied in one
+    # atomic update, so standings below are only credited for events that were actually stored
+    goals: Dict[ObjectId, int] = {}
+    for ev in evs:
+        scorer = scoring_team(m, ev)
+        if scorer is not None:
+            goals[scorer] = goals.get(scorer, 0) + 1
+    update = events_update(evs, goals.get(m["home_team_id"], 0), goals.get(m["away_team_id"], 0))
+    m = await db.match.find_one_and_update({"_id": oid}, update, return_document=ReturnDocument.AFTER)
+    if not m:
+        raise HTTPException(status_code=404, detail="Match not found")
+
+    await credit_events(m, goals, [credit for ev in evs for credit in player_credits(ev)])
+    return BsonORJSONResponse(serialize_match(m))
+
+@app.post("/matches/{match_id}/end")
+async def end_match(match_id: str):
+    if db is None:
+        raise HTTPException(status_code=500, detail="Database not configured")
+    oid = to_object_id(match_id)
+    # Only the request that actually ends the match matches the filter, so a result is credited
+    # to the standings exactly once even when /end is called concurrently or repeatedly
+    update = [{"$set": {"ended_at": utcnow(), "winner_team_id": WINNER_EXPR}}]
+    m = await db.match.find_one_and_update({"_id": oid, "ended_at": None}, update, return_document=ReturnDocument.AFTER)
+    if not m:
+        m = await db.match.find_one({"_id": oid})
+        if not m:
+            raise HTTPException(status_code=404, detail="Match not found")
+        return BsonORJSONResponse(serialize_match(m))
+
+    winner = m["winner_team_id"]
+    if winner is None:
+        ops = [UpdateOne({"_id": t}, {"$inc": {"draws": 1, "points": 1}}, upsert=True)
+               for t in (m["home_team_id"], m["away_team_id"])]
+    else:
+        loser = m["away_team_id"] if winner == m["home_team_id"] else m["home_team_id"]
+        ops = [
+            UpdateOne({"_id": winner}, {"$inc": {"wins": 1, "points": 3}}, upsert=True),
+            UpdateOne({"_id": loser}, {"$setOnInsert": {"goals": 0, "wins": 0, "draws": 0, "points": 0}}, upsert=True),
+        ]
+    await db.team_stats.bulk_write(ops, ordered=False)
+    # A zero ZINCRBY still adds the team to the goals boards, so goalless teams rank too
+    await bump_leaderboards({
+        t: {"goals": 0, "wins": 1 if winner == t else 0, "points": 3 if winner == t else 1 if winner is None else 0}
+        for t in (m["home_team_id"], m["away_team_id"])
+    }, [])
+    await invalidate("v1:lb")
+    return BsonORJSONResponse(serialize_match(m))
 
 @app.get("/matches/{match_id}")
-def get_match(match_id: str):
+async def get_match(match_id: str):
     if db is None:
         raise HTTPException(status_code=500, detail="Database not configured")
-    m = db.match.find_one({"_id": to_object_id(match_id)})
+    m = await db.match.find_one({"_id": to_object_id(match_id)})
     if not m:
         raise HTTPException(status_code=404, detail="Match not found")
-    return serialize_doc(m)
+    return BsonORJSONResponse(serialize_match(m))
 
 # ----------------------
 # Formations
@@ -258,75 +535,127 @@ class FormationSave(BaseModel):
     positions: List[dict]
 
 @app.get("/formations/{team_id}")
-def get_formation(team_id: str):
+async def get_formation(team_id: str):
     if db is None:
         raise HTTPException(status_code=500, detail="Database not configured")
-    doc = db.formation.find_one({"team_id": to_object_id(team_id)})
+    doc = await db.formation.find_one({"team_id": to_object_id(team_id)})
     if not doc:
-        return {"team_id": team_id, "name": "Default", "positions": []}
-    return serialize_doc(doc)
+        return BsonORJSONResponse({"team_id": team_id, "name": "Default", "positions": []})
+    return BsonORJSONResponse(serialize_doc(doc))
 
 @app.post("/formations")
-def save_formation(payload: FormationSave):
+async def save_formation(payload: FormationSave):
     if db is None:
         raise HTTPException(status_code=500, detail="Database not configured")
     data = payload.model_dump()
     data["team_id"] = to_object_id(data["team_id"])
-    data["updated_at"] = datetime.utcnow()
-    existing = db.formation.find_one({"team_id": data["team_id"]})
-    if existing:
-        db.formation.update_one({"_id": existing["_id"]}, {"$set": data})
-        saved = db.formation.find_one({"_id": existing["_id"]})
-    else:
-        data["created_at"] = datetime.utcnow()
-        _id = db.formation.insert_one(data).inserted_id
-        saved = db.formation.find_one({"_id": _id})
-    return serialize_doc(saved)
+    data["updated_at"] = utcnow()
+    # One formation per team (unique index on team_id): upsert instead of check-then-insert
+    saved = await db.formation.find_one_and_update(
+        {"team_id": data["team_id"]},
+        {"$set": data, "$setOnInsert": {"created_at": data["updated_at"]}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    return BsonORJSONResponse(serialize_doc(saved))
 
 # ----------------------
 # Leaderboards (teams & players)
 # ----------------------
+# join team details onto team_stats rows
+TEAM_DETAILS_STAGES = [
+    {"$lookup": {"from": "team", "localField": "_id", "foreignField": "_id", "as": "team"}},
+    {"$unwind": "$team"},
+    {"$project": {
+        "_id": 0,
+        "team_id": {"$toString": "$_id"},
+        "team_name": "$team.name",
+        "country": "$team.country",
+        "city": "$team.city",
+        "goals": {"$ifNull": ["$goals", 0]},
+        "wins": {"$ifNull": ["$wins", 0]},
+        "points": {"$ifNull": ["$points", 0]},
+    }},
+]
+
 @app.get("/leaderboard/teams")
-def leaderboard_teams(
+async def leaderboard_teams(
     scope: Literal["global","country","city"] = "global",
     country: Optional[str] = None,
     city: Optional[str] = None,
     stat: Literal["goals","wins","points"] = "goals",
-    limit: int = 20,
+    limit: int = Query(20, ge=1),
 ):
     if db is None:
         raise HTTPException(status_code=500, detail="Database not configured")
-
-    match_filter: Dict[str, Any] = {}
+    key = f"teams:{scope}:{country}:{city}:{stat}:{limit}"
+    return BsonORJSONResponse(await get_or_compute("v1:lb", key, lambda: _team_leaderboard(scope, country, city, stat, limit)))
+
+async def _team_leaderboard(scope: str, country: Optional[str], city: Optional[str], stat: str, limit: int):
+    # Rank from the Redis sorted set when available, then join the standings for those teams
+    ranked = await top_leaderboard(leaderboard_key("teams", stat, scope, country, city), limit)
+    if ranked is not None:
+        ids = [ObjectId(member) for member, _ in ranked]
+        stats = {st["_id"]: st async for st in db.team_stats.find({"_id": {"$in": ids}})}
+        teams = await get_teams_cached(ids)
+        rows = []
+        for oid in ids:
+            team = teams.get(oid)
+            if not team:
+                continue
+            st = stats.get(oid, {})
+            rows.append({
+                "team_id": str(oid),
+                "team_name": team.get("name"),
+                "country": team.get("country"),
+                "city": team.get("city"),
+                "goals": st.get("goals", 0),
+                "wins": st.get("wins", 0),
+                "points": st.get("points", 0),
+            })
+        return rows
+
+    stats_filter: Dict[str, Any] = {}
     team_filter: Dict[str, Any] = {}
     if scope in ("country", "city"):
         if country:
             team_filter["country"] = country
         if scope == "city" and city:
             team_filter["city"] = city
-        team_ids = [t["_id"] for t in db.team.find(team_filter, {"_id": 1})]
+        team_ids = [t["_id"] async for t in db.team.find(team_filter, {"_id": 1})]
         if not team_ids:
             return []
-        match_filter["$or"] = [{"home_team_id": {"$in": team_ids}}, {"away_team_id": {"$in": team_ids}}]
+        stats_filter["_id"] = {"$in": team_ids}
+
+    # Standings are maintained incrementally in team_stats by add_event/end_match
+    pipeline = [
+        {"$match": stats_filter},
+        {"$sort": {stat: -1}},
+        {"$limit": limit},
+        *TEAM_DETAILS_STAGES,
+    ]
+    return await db.team_stats.aggregate(pipeline).to_list(length=limit)
 
+# Recompute team_stats from scratch out of the match history (run once, before any worker serves)
+async def rebuild_team_stats():
+    ended = {"$ne": [{"$ifNull": ["$ended_at", None]}, None]}
     pipeline = [
-        {"$match": match_filter},
         {"$project": {
             "home_team_id": 1,
             "away_team_id": 1,
             "home_score": 1,
             "away_score": 1,
-            "events": 1,
+            "ended_at": 1,
         }},
         {"$project": {
             "pairs": [
-                {"team": "$home_team_id", "goals_for": "$home_score", "goals_against": "$away_score",
-                 "win": {"$cond": [{"$gt": ["$home_score", "$away_score"]}, 1, 0]},
-                 "draw": {"$cond": [{"$eq": ["$home_score", "$away_score"]}, 1, 0]},
+                {"team": "$home_team_id", "goals_for": "$home_score",
+                 "win": {"$cond": [{"$and": [ended, {"$gt": ["$home_score", "$away_score"]}]}, 1, 0]},
+                 "draw": {"$cond": [{"$and": [ended, {"$eq": ["$home_score", "$away_score"]}]}, 1, 0]},
                 },
-                {"team": "$away_team_id", "goals_for": "$away_score", "goals_against": "$home_score",
-                 "win": {"$cond": [{"$gt": ["$away_score", "$home_score"]}, 1, 0]},
-                 "draw": {"$cond": [{"$eq": ["$home_score", "$away_score"]}, 1, 0]},
+                {"team": "$away_team_id", "goals_for": "$away_score",
+                 "win": {"$cond": [{"$and": [ended, {"$gt": ["$away_score", "$home_score"]}]}, 1, 0]},
+                 "draw": {"$cond": [{"$and": [ended, {"$eq": ["$home_score", "$away_score"]}]}, 1, 0]},
                 },
             ]
         }},
@@ -340,37 +669,46 @@ def leaderboard_teams(
         {"$addFields": {"points": {"$add": [
             {"$multiply": ["$wins", 3]}, "$draws"
         ]}}},
-        {"$sort": {stat: -1}},
-        {"$limit": limit},
+        {"$merge": {"into": "team_stats", "whenMatched": "replace"}},
     ]
-    rows = list(db.match.aggregate(pipeline))
-    # join team details
-    results = []
-    for r in rows:
-        team = db.team.find_one({"_id": r["_id"]})
-        if not team:
-            continue
-        results.append({
-            "team_id": str(r["_id"]),
-            "team_name": team.get("name"),
-            "country": team.get("country"),
-            "city": team.get("city"),
-            "goals": r.get("goals", 0),
-            "wins": r.get("wins", 0),
-            "points": r.get("points", 0),
-        })
-    return results
+    await db.match.aggregate(pipeline).to_list(length=None)
 
 @app.get("/leaderboard/players")
-def leaderboard_players(
+async def leaderboard_players(
     scope: Literal["global","country","city"] = "global",
     country: Optional[str] = None,
     city: Optional[str] = None,
     stat: Literal["goals","assists","yellow","red"] = "goals",
-    limit: int = 20,
+    limit: int = Query(20, ge=1),
 ):
     if db is None:
         raise HTTPException(status_code=500, detail="Database not configured")
+    key = f"players:{scope}:{country}:{city}:{stat}:{limit}"
+    return BsonORJSONResponse(await get_or_compute("v1:lb", key, lambda: _player_leaderboard(scope, country, city, stat, limit)))
+
+async def _player_leaderboard(scope: str, country: Optional[str], city: Optional[str], stat: str, limit: int):
+    # Rank from the Redis sorted set when available, then hydrate those players from the L1 cache
+    ranked = await top_leaderboard(leaderboard_key(
+        "players", stat, scope, country if scope == "country" else None, city if scope == "city" else None
+    ), limit)
+    if ranked is not None:
+        players = await get_players_cached([ObjectId(member) for member, _ in ranked])
+        teams = await get_teams_cached({p["team_id"] for p in players.values() if p.get("team_id")})
+        rows = []
+        for member, score in ranked:
+            p = players.get(ObjectId(member))
+            if not p:
+                continue
+            team = teams.get(p.get("team_id"))
+            rows.append({
+                "player_id": member,
+                "player_name": p.get("name"),
+                "team_name": team.get("name") if team else None,
+                stat: int(score),
+                "country": p.get("country"),
+                "city": p.get("city"),
+            })
+        return rows
 
     # Filter players by scope
     player_filter: Dict[str, Any] = {}
@@ -380,16 +718,28 @@ def leaderboard_players(
         player_filter["city"] = city
     player_ids = None
     if player_filter:
-        player_ids = [p["_id"] for p in db.player.find(player_filter, {"_id": 1})]
+        player_ids = [p["_id"] async for p in db.player.find(player_filter, {"_id": 1})]
         if not player_ids:
             return []
 
+    # Restrict to events involving scoped players, both on whole matches and after unwinding
+    event_filter: Dict[str, Any] = {}
+    if player_ids is not None:
+        if stat == "assists":
+            event_filter = {"$or": [
+                {"events.player_id": {"$in": player_ids}},
+                {"events.secondary_player_id": {"$in": player_ids}},
+            ]}
+        else:
+            event_filter = {"events.player_id": {"$in": player_ids}}
+
     # Unwind events across matches and count by player
-    match_filter: Dict[str, Any] = {}
     pipeline = [
-        {"$match": match_filter},
+        {"$match": event_filter},
+        {"$project": {"events": 1}},
         {"$unwind": "$events"},
-        {"$match": {"events.type": {"$in": ["goal", "assist", "yellow", "red"]}}},
+        {"$project": {"events.type": 1, "events.player_id": 1, "events.secondary_player_id": 1}},
+        {"$match": {"events.type": {"$in": ["goal", "assist", "yellow", "red"]}, **event_filter}},
     ]
     if stat == "goals":
         pipeline.append({"$match": {"events.type": "goal"}})
@@ -405,8 +755,10 @@ def leaderboard_players(
                     ]
                 }
             }},
-            {"$group": {"_id": "$pid", "count": {"$sum": 1}}},
         ])
+        if player_ids is not None:
+            pipeline.append({"$match": {"pid": {"$in": player_ids}}})
+        pipeline.append({"$group": {"_id": "$pid", "count": {"$sum": 1}}})
         key = None
     else:
         pipeline.append({"$match": {"events.type": stat}})
@@ -417,40 +769,71 @@ def leaderboard_players(
             {"$group": {"_id": f"${key}", "count": {"$sum": 1}}},
         ])
 
-    if player_ids is not None:
-        pipeline.insert(0, {"$match": {}})  # placeholder no-op
-
     pipeline.extend([
         {"$sort": {"count": -1}},
         {"$limit": limit},
     ])
 
-    rows = list(db.match.aggregate(pipeline))
+    # join player and team details
+    pipeline.extend([
+        {"$lookup": {"from": "player", "localField": "_id", "foreignField": "_id", "as": "player"}},
+        {"$unwind": "$player"},
+        {"$lookup": {"from": "team", "localField": "player.team_id", "foreignField": "_id", "as": "team"}},
+        {"$unwind": {"path": "$team", "preserveNullAndEmptyArrays": True}},
+        {"$project": {
+            "_id": 0,
+            "player_id": {"$toString": "$_id"},
+            "player_name": "$player.name",
+            "team_name": {"$ifNull": ["$team.name", None]},
+            stat: "$count",
+            "country": {"$ifNull": ["$player.country", None]},
+            "city": {"$ifNull": ["$player.city", None]},
+        }},
+    ])
 
-    # If scope filtered players, keep only those ids
-    if player_ids is not None:
-        rows = [r for r in rows if r["_id"] in set(player_ids)]
-
-    results = []
-    for r in rows:
-        if r["_id"] is None:
-            continue
-        p = db.player.find_one({"_id": r["_id"]})
-        if not p:
-            continue
-        team = db.team.find_one({"_id": p.get("team_id")}) if p.get("team_id") else None
-        results.append({
-            "player_id": str(r["_id"]),
-            "player_name": p.get("name"),
-            "team_name": team.get("name") if team else None,
-            stat: r.get("count", 0),
-            "country": p.get("country"),
-            "city": p.get("city"),
-        })
-    return results
+    return await db.match.aggregate(pipeline).to_list(length=limit)
+
+# Current standings from team_stats and the match history, used to seed the Redis sorted sets
+async def load_leaderboard_entries() -> List[LeaderboardEntry]:
+    pipeline = [
+        {"$lookup": {"from": "team", "localField": "_id", "foreignField": "_id", "as": "team"}},
+        {"$unwind": "$team"},
+    ]
+    entries: List[LeaderboardEntry] = []
+    async for r in db.team_stats.aggregate(pipeline):
+        for stat in ("goals", "wins", "points"):
+            entries.append(("teams", stat, str(r["_id"]), r.get(stat, 0), r["team"].get("country"), r["team"].get("city")))
+
+    pipeline = [
+        {"$project": {"events": 1}},
+        {"$unwind": "$events"},
+        {"$project": {"credits": {"$switch": {
+            "branches": [
+                {"case": {"$eq": ["$events.type", "goal"]}, "then": [
+                    {"pid": "$events.player_id", "stat": "goals"},
+                    {"pid": "$events.secondary_player_id", "stat": "assists"},
+                ]},
+                {"case": {"$eq": ["$events.type", "assist"]}, "then": [
+                    {"pid": "$events.player_id", "stat": "assists"},
+                ]},
+                {"case": {"$in": ["$events.type", ["yellow", "red"]]}, "then": [
+                    {"pid": "$events.player_id", "stat": "$events.type"},
+                ]},
+            ],
+            "default": [],
+        }}}},
+        {"$unwind": "$credits"},
+        {"$match": {"credits.pid": {"$ne": None}}},
+        {"$group": {"_id": {"pid": "$credits.pid", "stat": "$credits.stat"}, "count": {"$sum": 1}}},
+        {"$lookup": {"from": "player", "localField": "_id.pid", "foreignField": "_id", "as": "player"}},
+        {"$unwind": "$player"},
+    ]
+    async for r in db.match.aggregate(pipeline):
+        entries.append(("players", r["_id"]["stat"], str(r["_id"]["pid"]), r["count"], r["player"].get("country"), r["player"].get("city")))
+    return entries
 
 
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    uvicorn.run("main:app", host="0.0.0.0", port=port, workers=os.cpu_count(), loop="uvloop", http="httptools")
@@ -0,0 +1,42 @@
+from cache import leaderboard_key, leaderboard_keys
+
+
+def test_leaderboard_key_scopes():
+    assert leaderboard_key("teams", "goals") == "lb:teams:goals:global"
+    assert leaderboard_key("teams", "goals", "country", country="Mexico") == "lb:teams:goals:country:Mexico"
+    assert leaderboard_key("teams", "goals", "city", city="Monterrey") == "lb:teams:goals:city:Monterrey"
+    # a city scope without a city narrows to the country, and without either is global
+    assert leaderboard_key("teams", "goals", "city", country="Mexico") == "lb:teams:goals:country:Mexico"
+    assert leaderboard_key("players", "red", "country") == "lb:players:red:global"
+
+
+def test_leaderboard_keys_member_sets():
+    assert leaderboard_keys("players", "goals", "India", "Mumbai") == [
+        "lb:players:goals:global",
+        "lb:players:goals:country:India",
+        "lb:players:goals:city:Mumbai",
+        "lb:players:goals:country:India:city:Mumbai",
+    ]
+    assert leaderboard_keys("players", "goals") == ["lb:players:goals:global"]
+    assert leaderboard_keys("teams", "wins", city="Mumbai") == ["lb:teams:wins:global", "lb:teams:wins:city:Mumbai"]
+
+
+def test_leaderboard_keys_city_and_country_with_same_name_are_distinct():
+    keys = leaderboard_keys("players", "goals", "Mexico", "Mexico")
+    assert keys == [
+        "lb:players:goals:global",
+        "lb:players:goals:country:Mexico",
+        "lb:players:goals:city:Mexico",
+        "lb:players:goals:country:Mexico:city:Mexico",
+    ]
+    assert len(set(keys)) == len(keys)
+
+
+def test_city_scope_with_country_is_qualified_by_country():
+    valencia_es = leaderboard_key("teams", "points", "city", "Spain", "Valencia")
+    valencia_ve = leaderboard_key("teams", "points", "city", "Venezuela", "Valencia")
+    assert valencia_es == "lb:teams:points:country:Spain:city:Valencia"
+    assert valencia_es != valencia_ve
+    # a member is written to the qualified set that such a read looks up
+    assert valencia_es in leaderboard_keys("teams", "points", "Spain", "Valencia")
+    assert valencia_es not in leaderboard_keys("teams", "points", "Venezuela", "Valencia")
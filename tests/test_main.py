@@ -0,0 +1,152 @@
+import asyncio
+
+import orjson
+from bson import ObjectId
+from fastapi.testclient import TestClient
+
+import main
+
+client = TestClient(main.app)
+
+BULK_URL = "/matches/65a000000000000000000001/events:bulk"
+
+HOME, AWAY, OTHER = ObjectId(), ObjectId(), ObjectId()
+MATCH = {"home_team_id": HOME, "away_team_id": AWAY}
+
+
+def test_bulk_events_rejects_oversized_batches():
+    events = [{"type": "yellow"}] * (main.MAX_BULK_EVENTS + 1)
+    assert client.post(BULK_URL, json=events).status_code == 422
+
+
+def test_bulk_events_validates_each_event():
+    assert client.post(BULK_URL, json={"type": "yellow"}).status_code == 422
+    assert client.post(BULK_URL, json=[{"type": "corner"}]).status_code == 422
+    assert client.post(BULK_URL, json=[{"type": "goal", "minute": 61}]).status_code == 422
+
+
+def test_bulk_events_accepts_a_full_batch(monkeypatch):
+    # passes validation and reaches the handler, which needs a database
+    monkeypatch.setattr(main, "db", None)
+    events = [{"type": "yellow"}] * main.MAX_BULK_EVENTS
+    response = client.post(BULK_URL, json=events)
+    assert response.status_code == 500
+    assert response.json() == {"detail": "Database not configured"}
+
+
+def test_scoring_team_goals_and_own_goals():
+    assert main.scoring_team(MATCH, {"type": "goal", "team_id": HOME}) == HOME
+    assert main.scoring_team(MATCH, {"type": "goal", "team_id": AWAY}) == AWAY
+    # an own goal counts for the other side
+    assert main.scoring_team(MATCH, {"type": "own_goal", "team_id": HOME}) == AWAY
+    assert main.scoring_team(MATCH, {"type": "own_goal", "team_id": AWAY}) == HOME
+
+
+def test_scoring_team_ignores_events_that_do_not_score():
+    assert main.scoring_team(MATCH, {"type": "goal", "team_id": OTHER}) is None
+    assert main.scoring_team(MATCH, {"type": "own_goal", "team_id": OTHER}) is None
+    assert main.scoring_team(MATCH, {"type": "goal", "team_id": None}) is None
+    assert main.scoring_team(MATCH, {"type": "yellow", "team_id": HOME}) is None
+
+
+def test_player_credits():
+    scorer, assister = ObjectId(), ObjectId()
+    assert main.player_credits({"type": "goal", "player_id": scorer, "secondary_player_id": assister}) == [
+        ("goals", scorer), ("assists", assister),
+    ]
+    assert main.player_credits({"type": "assist", "player_id": assister}) == [("assists", assister)]
+    assert main.player_credits({"type": "yellow", "player_id": scorer}) == [("yellow", scorer)]
+    assert main.player_credits({"type": "red", "player_id": scorer}) == [("red", scorer)]
+    assert main.player_credits({"type": "own_goal", "player_id": scorer}) == []
+    assert main.player_credits({"type": "substitution", "player_id": scorer}) == []
+
+
+def test_player_credits_skip_missing_players():
+    scorer = ObjectId()
+    assert main.player_credits({"type": "goal", "player_id": scorer, "secondary_player_id": None}) == [("goals", scorer)]
+    assert main.player_credits({"type": "goal"}) == []
+    assert main.player_credits({"type": "yellow", "player_id": None}) == []
+
+
+def test_stringify_ids_skips_missing_and_null_fields():
+    doc = {"team_id": HOME, "player_id": None, "minute": 3}
+    main._stringify_ids(doc, main._EVENT_ID_FIELDS)
+    assert doc == {"team_id": str(HOME), "player_id": None, "minute": 3}
+
+
+def test_serialize_match():
+    match_id, player = ObjectId(), ObjectId()
+    doc = {
+        "_id": match_id,
+        "home_team_id": HOME,
+        "away_team_id": AWAY,
+        "winner_team_id": None,
+        "events": [
+            {"type": "goal", "team_id": HOME, "player_id": player, "secondary_player_id": None},
+            {"type": "substitution"},
+        ],
+    }
+    assert main.serialize_match(doc) == {
+        "id": str(match_id),
+        "home_team_id": str(HOME),
+        "away_team_id": str(AWAY),
+        "winner_team_id": None,
+        "events": [
+            {"type": "goal", "team_id": str(HOME), "player_id": str(player), "secondary_player_id": None},
+            {"type": "substitution"},
+        ],
+    }
+
+
+def test_serialize_match_without_events():
+    match_id = ObjectId()
+    doc = main.serialize_match({"_id": match_id, "home_team_id": HOME, "away_team_id": AWAY})
+    assert doc == {"id": str(match_id), "home_team_id": str(HOME), "away_team_id": str(AWAY)}
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = iter(docs)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self.docs)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+def collect(cursor, serialize=main.serialize_doc):
+    async def run():
+        return b"".join([chunk async for chunk in main.stream_json_array(cursor, serialize)])
+    return asyncio.run(run())
+
+
+def test_stream_json_array_empty_cursor():
+    assert collect(FakeCursor([])) == b"[]"
+
+
+def test_stream_json_array_is_valid_json():
+    teams = [{"_id": ObjectId(), "name": "A"}, {"_id": ObjectId(), "name": "B"}]
+    ids = [str(t["_id"]) for t in teams]
+    body = collect(FakeCursor(teams), main.serialize_team)
+    assert orjson.loads(body) == [{"id": ids[0], "name": "A"}, {"id": ids[1], "name": "B"}]
+
+
+def test_stream_json_array_single_document_without_id():
+    assert orjson.loads(collect(FakeCursor([{"name": "A"}]))) == [{"name": "A"}]
+
+
+def test_result_delta_for_late_goals():
+    ended = dict(MATCH, ended_at=main.utcnow())
+    # 0-1 becomes 1-1: the away win turns into a draw
+    assert main.result_delta(dict(ended, home_score=1, away_score=1), {HOME: 1}) == {
+        HOME: {"draws": 1, "points": 1},
+        AWAY: {"wins": -1, "draws": 1, "points": -2},
+    }
+    # 2-0 becomes 3-0: same result, standings unchanged
+    assert main.result_delta(dict(ended, home_score=3, away_score=0), {HOME: 1}) == {}
+    # matches still in play are credited when they end
+    assert main.result_delta(dict(MATCH, ended_at=None, home_score=1, away_score=0), {HOME: 1}) == {}